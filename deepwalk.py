@@ -1,10 +1,10 @@
-import tensorflow_addons as tfa
 import argparse
 import tensorflow as tf
+import tensorflow.keras as keras
 
 from walker import BaseWalker
 from word2vec import Word2Vec
-from utils import generate_word, embed_visual
+from utils import generate_word, embed_visual, adamw_weight_decay
 from data import Cora
 
 parser = argparse.ArgumentParser()
@@ -30,7 +30,7 @@ walker = BaseWalker(cora.train_g, num_walks=10, walk_length=50, workers=5)
 sentences = walker.simulate_walks()
 batch, label = generate_word(sentences, num_skips=2, skip_window=3)
 model = Word2Vec(cora.g.node_size, arg.embed_size, num_sampled=10)
-model.compile(optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay))
+model.compile(optimizer=keras.optimizers.AdamW(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)))
 model.fit((batch, label), batch_size=arg.batch_size, epochs=arg.epoch_size)
 
 embedding_matrix = model.embedding.numpy()
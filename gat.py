@@ -1,8 +1,7 @@
 from data import Cora
 from layers import GraphAttention
-from utils import embed_visual, svm
+from utils import embed_visual, svm, convert_coo_to_sparse, adamw_weight_decay
 import tensorflow.keras as keras
-import tensorflow_addons as tfa
 import tensorflow as tf
 import argparse
 from sampler import RandomSubGraph
@@ -24,27 +23,30 @@ parser.add_argument("--epoch", type=int, default=50)
 parser.add_argument("--dropout_prob", type=float, default=0.3)
 parser.add_argument("--batch_size", type=int, default=512)
 parser.add_argument("--num_sample_step", type=int, default=100)
+parser.add_argument("--mixed_precision", action="store_true")
 
 arg = parser.parse_args()
+if arg.mixed_precision:
+    keras.mixed_precision.set_global_policy("mixed_bfloat16")
 
 cora = Cora()
 
-A_in = keras.layers.Input((None, ))
+A_in = keras.layers.Input((None, ), sparse=True)  # attention is only evaluated on the edges
 X_in = keras.layers.Input((cora.g.node_feature_size,))
 o = GraphAttention(arg.embed_size)([X_in, A_in])
 gat_ = keras.Model(inputs=[X_in, A_in], outputs=o)
 o = keras.layers.Dropout(arg.dropout_prob)(o)
 o = GraphAttention(arg.embed_size, attn_heads_reduction="concat")([o, A_in])
-o = GraphAttention(cora.g.label_size, attn_heads=1, activation="sigmoid")([o, A_in])
+o = GraphAttention(cora.g.label_size, attn_heads=1, activation="sigmoid", dtype="float32")([o, A_in])
 
 gat = keras.Model(inputs=[X_in, A_in], outputs=o)
 gat.compile(loss=keras.losses.SparseCategoricalCrossentropy(),
-            optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay),
+            optimizer=keras.optimizers.AdamW(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)),
             metrics=[keras.metrics.SparseCategoricalAccuracy()])
-A = cora.g.adj.toarray()
+A = convert_coo_to_sparse(cora.g.adj, tf.int32)
 X = cora.g.node_feature
 sample = RandomSubGraph(cora.g, arg.batch_size, arg.num_sample_step)
-data = sample.supervised_feature()
-gat.fit(data, epochs=arg.epoch, shuffle=False)
+data = sample.supervised_feature(sparse=True)
+gat.fit(data, epochs=arg.epoch)
 embedding_matrix = gat_([X, A])
 embed_visual(embedding_matrix, cora.g.node_label, filename="./results/img/cora_gat.png")
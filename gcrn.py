@@ -2,11 +2,10 @@ import tensorflow as tf
 import tensorflow.keras as keras
 import numpy as np
 import argparse
-import tensorflow_addons as tfa
 from layers import GCRN1Cell, GCRN2Cell, GraphAttention, SampleSoftmaxLoss
 from data import Book
 from sampler import RandomTemporalSubGraph
-from utils import embed_visual
+from utils import embed_visual, adamw_weight_decay
 
 gpus = tf.config.experimental.list_physical_devices('GPU')
 if gpus:
@@ -27,7 +26,10 @@ parser.add_argument("--alpha", type=float, default=0.3)
 parser.add_argument("-beta", type=float, default=10.)
 parser.add_argument("--num_sample_step", type=int, default=100)
 parser.add_argument("--seq_len", type=int, default=10)
+parser.add_argument("--mixed_precision", action="store_true")
 arg = parser.parse_args()
+if arg.mixed_precision:
+    keras.mixed_precision.set_global_policy("mixed_bfloat16")
 
 book = Book()
 book.g.discrete(arg.seq_len)
@@ -38,14 +40,14 @@ data = sample.supervised()
 nodes = keras.layers.Input(shape=(), batch_size=arg.batch_size)
 adjs = keras.layers.Input(shape=(arg.seq_len, None), batch_size=arg.batch_size)
 nodes_embed = keras.layers.Embedding(input_dim=book.g.node_size, output_dim=arg.embed_size)(nodes)
-o = keras.layers.RNN(GCRN2Cell(arg.embed_size, GraphAttention, {"units": arg.embed_size}))(adjs, initial_state=nodes_embed)
-cls_o = keras.layers.Dense(book.g.label_size, activation="sigmoid")(o)
+o = keras.layers.RNN(GCRN2Cell(arg.embed_size, GraphAttention, {"units": arg.embed_size}), unroll=True)(adjs, initial_state=nodes_embed)  # seq_len is fixed and short
+cls_o = keras.layers.Dense(book.g.label_size, activation="sigmoid", dtype="float32")(o)
 supervised_gcrn_ = keras.Model(inputs=(nodes, adjs), outputs=o)
 supervised_gcrn = keras.Model(inputs=[nodes, adjs], outputs=cls_o)
 supervised_gcrn.compile(loss=keras.losses.SparseCategoricalCrossentropy(),
-                optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay),
+                optimizer=keras.optimizers.AdamW(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)),
                 metrics=[keras.metrics.SparseCategoricalAccuracy()])
-supervised_gcrn.fit(data, epochs=arg.epoch_size, shuffle=False)
+supervised_gcrn.fit(data, epochs=arg.epoch_size)
 
 dis_array = np.stack([adj.toarray() for adj in book.g.discrete_adj_list], axis=1)
 embedding_matrix = supervised_gcrn_([book.g.node_array, dis_array])
@@ -58,13 +60,13 @@ adjs = keras.layers.Input(shape=(None, None), batch_size=arg.batch_size)
 labels = keras.layers.Input((), batch_size=arg.batch_size)
 nodes_embed = keras.layers.Embedding(input_dim=book.g.node_size, output_dim=arg.embed_size)(nodes)
 o = keras.layers.RNN(GCRN2Cell(arg.embed_size, GraphAttention, {"units": arg.embed_size}))(adjs, initial_state=nodes_embed)
-o = keras.layers.Dense(book.g.label_size, activation="sigmoid")(o)
+o = keras.layers.Dense(book.g.label_size, activation="sigmoid", dtype="float32")(o)
 train_o = SampleSoftmaxLoss(node_size=book.g.node_size)([labels, o])
 
 unsupervised_gcrn = keras.Model(inputs=[nodes, adjs], outputs=o)
 unsupervised_gcrn_train = keras.Model(inputs=[nodes, adjs, labels], outputs=train_o)
-unsupervised_gcrn_train.compile(optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay))
-unsupervised_gcrn_train.fit(data, epochs=arg.epoch_size, shuffle=False)
+unsupervised_gcrn_train.compile(optimizer=keras.optimizers.AdamW(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)))
+unsupervised_gcrn_train.fit(data, epochs=arg.epoch_size)
 
 dis_array = np.stack([adj.toarray() for adj in book.g.discrete_adj_list], axis=1)
 embedding_matrix = unsupervised_gcrn([book.g.node_array, dis_array])
@@ -3,6 +3,7 @@ from scipy.sparse import coo_matrix
 import scipy.sparse as sp
 from utils import read_csv, Vocab, read_txt
 import collections
+import hashlib
 from pathlib import Path
 import typing
 
@@ -11,6 +12,7 @@ class StaticGraph:
     def __init__(self):
         self._adj = None
         self._adj_csr = None
+        self._adj_norm_csr = None
         self._vocab = None
         self._label_vocab = None
         self._node_label = None
@@ -24,10 +26,39 @@ class StaticGraph:
     def adj_csr(self) -> sp.csr_matrix:
         return self._adj_csr
 
+    @property
+    def adj_norm_csr(self) -> sp.csr_matrix:  # D^-1/2 A D^-1/2, computed once
+        if self._adj_norm_csr is None:
+            d = np.power(np.asarray(self._adj_csr.sum(axis=1), dtype=np.float32).flatten(), -0.5)
+            d[np.isinf(d)] = 0.
+            d = sp.diags(d)
+            self._adj_norm_csr = (d @ self._adj_csr @ d).tocsr().astype(np.float32)
+        return self._adj_norm_csr
+
+    def _adj_fingerprint(self) -> str:  # hash of the canonical csr arrays, changes with any edited edge
+        adj_csr = self._adj_csr.copy()
+        adj_csr.sum_duplicates()
+        h = hashlib.sha1(str(adj_csr.shape).encode())
+        for a in (adj_csr.indptr, adj_csr.indices, adj_csr.data):
+            h.update(np.ascontiguousarray(a).tobytes())
+        return h.hexdigest()
+
+    def cache_adj_norm(self, filename: Path):  # reuse adj_norm_csr from disk across runs
+        fingerprint_file = filename.with_name(filename.name + ".sha1")  # fingerprint of the adj it was built from
+        fingerprint = self._adj_fingerprint()
+        if filename.exists() and fingerprint_file.exists() and fingerprint_file.read_text() == fingerprint:
+            self._adj_norm_csr = sp.load_npz(filename).tocsr()
+            return
+        # a file left by another dataset or an edited edge list is recomputed and overwritten
+        self._adj_norm_csr = None
+        sp.save_npz(filename, self.adj_norm_csr)
+        fingerprint_file.write_text(fingerprint)
+
     @adj.setter
     def adj(self, x):
         self._adj = x
         self._adj_csr = self._adj.tocsr()
+        self._adj_norm_csr = None
 
     @property
     def node_size(self) -> int:
@@ -107,6 +138,7 @@ class StaticGraph:
         self._adj = coo_matrix((np.ones(len(edge_array)), (edge_array[:, 0], edge_array[:, 1])), shape=(len(self._vocab), len(self._vocab)))
         self._adj_csr = self._adj.tocsr() + sp.eye(len(self._vocab))
         self._adj = self._adj_csr.tocoo()
+        self._adj_norm_csr = None
 
     def get_node_neighbors(self, node: int) -> np.ndarray:
         return self._adj_csr[node].indices
@@ -158,11 +190,10 @@ class TemporalGraph(StaticGraph):
         min_t = np.min(nonzero)
         max_t = np.max(nonzero)
         slice_ = (max_t - min_t) // slots
-        adj_t = self.adj_t.toarray()
-        adj = self.adj.toarray()
+        adj = self.adj_csr
         for i in range(1, slots + 1):
-            adj_ = adj.copy()
-            adj_[np.where(adj_t > min_t + slice_ * i)] = 0
+            adj_ = adj - adj.multiply(self.adj_t_csr > min_t + slice_ * i)  # drop the edges newer than this slot
+            adj_.eliminate_zeros()
             g = StaticGraph()
             g.adj = sp.coo_matrix(adj_)
             self.discrete_g_list.append(g)
@@ -196,4 +227,5 @@ class TemporalGraph(StaticGraph):
         self._adj_t = coo_matrix((edge_array[:, 2], (edge_array[:, 0], edge_array[:, 1])), shape=(len(self._vocab), len(self._vocab)))
         self._adj_csr = self._adj.tocsr() + sp.eye(len(self._vocab))
         self._adj = self._adj_csr.tocoo()
+        self._adj_norm_csr = None
         self._adj_t_csr = self._adj_t.tocsr()
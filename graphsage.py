@@ -1,8 +1,7 @@
 from data import Cora
 from layers import GraphSageConv, SampleSoftmaxLoss
-from utils import embed_visual, svm
+from utils import embed_visual, svm, convert_coo_to_sparse, adamw_weight_decay
 import tensorflow.keras as keras
-import tensorflow_addons as tfa
 import tensorflow as tf
 import argparse
 from sampler import RandomSubGraph
@@ -30,7 +29,7 @@ arg = parser.parse_args()
 cora = Cora()
 
 # supervised
-A_in = keras.layers.Input((None, ), batch_size=arg.batch_size)
+A_in = keras.layers.Input((None, ), batch_size=arg.batch_size, sparse=True)
 X_in = keras.layers.Input((cora.g.node_feature_size,), batch_size=arg.batch_size)
 o = GraphSageConv(arg.embed_size)([X_in, A_in])
 graphsage_ = keras.Model(inputs=[X_in, A_in], outputs=o)
@@ -40,18 +39,18 @@ o = GraphSageConv(cora.g.label_size, activation="sigmoid")([o, A_in])
 
 supervised_graphsage = keras.Model(inputs=[X_in, A_in], outputs=o)
 supervised_graphsage.compile(loss=keras.losses.SparseCategoricalCrossentropy(),
-            optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay),
+            optimizer=keras.optimizers.AdamW(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)),
             metrics=[keras.metrics.SparseCategoricalAccuracy()])
-A = cora.g.adj.toarray()
+A = convert_coo_to_sparse(cora.g.adj, tf.int32)
 X = cora.g.node_feature
 sample = RandomSubGraph(cora.g, arg.batch_size, arg.num_sample_step)
-data = sample.supervised_feature()
-supervised_graphsage.fit(data, epochs=arg.epoch, shuffle=False)
+data = sample.supervised_feature(sparse=True)
+supervised_graphsage.fit(data, epochs=arg.epoch)
 embedding_matrix = graphsage_([X, A])
 embed_visual(embedding_matrix, cora.g.node_label, filename="./results/img/cora_graphsage_supervised.png")
 
 # unsupervised
-A_in = keras.layers.Input((None, ), batch_size=arg.batch_size)
+A_in = keras.layers.Input((None, ), batch_size=arg.batch_size, sparse=True)
 X_in = keras.layers.Input((cora.g.node_feature_size,), batch_size=arg.batch_size)
 labels = keras.layers.Input((), batch_size=arg.batch_size)
 o = GraphSageConv(arg.embed_size)([X_in, A_in])
@@ -61,12 +60,12 @@ o = GraphSageConv(arg.embed_size)([o, A_in])
 train_o = SampleSoftmaxLoss(node_size=cora.g.node_size)([labels, o])
 unsupervised_graphsage = keras.Model(inputs=[X_in, A_in], outputs=o)
 unsupervised_graphsage_train = keras.Model(inputs=[X_in, A_in, labels], outputs=train_o)
-unsupervised_graphsage_train.compile(optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay))
+unsupervised_graphsage_train.compile(optimizer=keras.optimizers.AdamW(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)))
 
-A = cora.g.adj.toarray()
+A = convert_coo_to_sparse(cora.g.adj, tf.int32)
 X = cora.g.node_feature
 sample = RandomSubGraph(cora.g, arg.batch_size, arg.num_sample_step)
-data = sample.unsupervised_feature()
-unsupervised_graphsage_train.fit(data, epochs=arg.epoch, shuffle=False)
+data = sample.unsupervised_feature(sparse=True)
+unsupervised_graphsage_train.fit(data, epochs=arg.epoch)
 embedding_matrix = unsupervised_graphsage([X, A])
 embed_visual(embedding_matrix, cora.g.node_label, filename="./results/img/cora_graphsage_unsupervised.png")
@@ -1,10 +1,18 @@
+import math
 import tensorflow as tf
 import tensorflow.keras as keras
 import typing
 
 
+def dropout(x, rate, training=None):  # plain op instead of a Dropout layer per call; a no-op outside training
+    if training and rate > 0.:
+        return tf.nn.dropout(x, rate)
+    return x
+
+
 class SampleSoftmaxLoss(keras.layers.Layer):
     def __init__(self, node_size, num_sampled=5, **kwargs):
+        kwargs.setdefault("dtype", "float32")  # the loss stays in float32 under mixed precision
         super(SampleSoftmaxLoss, self).__init__(**kwargs)
         self.node_size = node_size
         self.num_sampled = num_sampled
@@ -32,8 +40,8 @@ class SampleSoftmaxLoss(keras.layers.Layer):
 class GraphAttention(keras.layers.Layer):
     def __init__(self, units, attn_heads=8, dropout_prob=0.3, activation="elu",
                  attn_heads_reduction='mean', kernel_initializer='glorot_uniform',
-                 bias_initializer='zeros'):
-        super(GraphAttention, self).__init__()
+                 bias_initializer='zeros', **kwargs):
+        super(GraphAttention, self).__init__(**kwargs)
         self.units = units
         self.attn_heads = attn_heads
         self.activation = keras.activations.get(activation)
@@ -42,62 +50,72 @@ class GraphAttention(keras.layers.Layer):
         self.kernel_initializer = kernel_initializer
         self.bias_initializer = bias_initializer
 
-        self.kernels = list()
-        self.biases = list()
-        self.attn_kernels = list()
-
         self.attn_heads_reduction = attn_heads_reduction
 
     def build(self, input_shape):  # X, A
         input_feature_size = input_shape[0][-1]
-        for head in range(self.attn_heads):
-            kernel = self.add_weight(shape=(input_feature_size, self.units), initializer=self.kernel_initializer)
-            self.kernels.append(kernel)
-            bias = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-            self.biases.append(bias)
-            attn_kernel_self = self.add_weight(shape=(self.units, 1), initializer=self.kernel_initializer)
-            attn_kernel_neighs = self.add_weight(shape=(self.units, 1), initializer=self.kernel_initializer)
-            self.attn_kernels.append([attn_kernel_self, attn_kernel_neighs])
+        # all heads are stacked so each projection is one matmul
+        self.kernel = self.add_weight(shape=(input_feature_size, self.attn_heads * self.units), initializer=self.kernel_initializer)
+        self.bias = self.add_weight(shape=(self.attn_heads, 1, self.units), initializer=self.bias_initializer)
+        self.attn_kernel = self.add_weight(shape=(self.attn_heads, self.units, 2), initializer=self.kernel_initializer)  # self, neighs
 
         self.built = True
 
-    def call(self, inputs, **kwargs):
+    def call(self, inputs, training=None, **kwargs):
         X = inputs[0]
-        A = tf.cast(inputs[1], tf.float32)
-        outputs = list()
+        A = inputs[1]
 
-        for head in range(self.attn_heads):
-            kernel = self.kernels[head]
-            attention_kernel = self.attn_kernels[head]
+        X = dropout(X, self.dropout_prob, training)
+        features = tf.reshape(tf.matmul(X, self.kernel), [-1, self.attn_heads, self.units])
+        features = tf.transpose(features, [1, 0, 2])  # heads, node_size, units
 
-            X = keras.layers.Dropout(self.dropout_prob)(X)
-            features = tf.matmul(X, kernel)
+        attn = tf.matmul(features, self.attn_kernel)  # heads, node_size, 2
+        attn_for_self, attn_for_neighs = tf.split(attn, 2, axis=-1)
 
-            attn_for_self = tf.matmul(features, attention_kernel[0])
-            attn_for_neighs = tf.matmul(features, attention_kernel[1])
+        if isinstance(A, tf.SparseTensor):
+            node_features = self._sparse_attention(features, attn_for_self, attn_for_neighs, A, training)
+        else:
+            node_features = self._dense_attention(features, attn_for_self, attn_for_neighs, A, training)
+        node_features += self.bias
 
-            dense = attn_for_self + tf.transpose(attn_for_neighs)
-            dense = keras.layers.LeakyReLU(0.2)(dense)
-            mask = (1.0 - A) * (-10e9)
-            dense += mask
-            dense = tf.nn.softmax(dense)
+        output = self.activation(node_features)
 
-            dropout_attn = tf.keras.layers.Dropout(self.dropout_prob)(dense)
-            dropout_feat = tf.keras.layers.Dropout(self.dropout_prob)(features)
+        if self.attn_heads_reduction == 'concat':
+            output = tf.reshape(tf.transpose(output, [1, 0, 2]), [-1, self.attn_heads * self.units])
+        else:
+            output = tf.reduce_mean(output, axis=0)
+        return output
 
-            node_features = tf.matmul(dropout_attn, dropout_feat)
+    @tf.function(jit_compile=True)  # the sparse path stays un-jitted, XLA takes no SparseTensor or dynamic num_segments
+    def _dense_attention(self, features, attn_for_self, attn_for_neighs, A, training):
+        mask = A > 0  # attend over neighbours only
+        dense = attn_for_self + tf.reshape(attn_for_neighs, [self.attn_heads, 1, -1])  # heads, node_size, node_size
+        dense = tf.nn.leaky_relu(dense, alpha=0.2)
+        dense = tf.where(mask, tf.cast(dense, tf.float32), -10e9)  # softmax stays in float32 under mixed precision
+        dense = tf.cast(tf.nn.softmax(dense), features.dtype)
 
-            node_features = tf.nn.bias_add(node_features, self.biases[head])
+        dropout_attn = dropout(dense, self.dropout_prob, training)
+        dropout_feat = dropout(features, self.dropout_prob, training)
 
-            # Add output of attention head to final output
-            output = self.activation(node_features)
-            outputs.append(output)
+        return tf.matmul(dropout_attn, dropout_feat)  # heads, node_size, units
 
-        if self.attn_heads_reduction == 'concat':
-            output = tf.concat(outputs, axis=-1)
-        else:
-            output = tf.reduce_mean(tf.stack(outputs), axis=0)
-        return output
+    def _sparse_attention(self, features, attn_for_self, attn_for_neighs, A, training):  # logits only on the edges of A
+        rows, cols = A.indices[:, 0], A.indices[:, 1]
+        node_size = tf.shape(features)[1]
+        edges = tf.gather(attn_for_self[..., 0], rows, axis=1) + tf.gather(attn_for_neighs[..., 0], cols, axis=1)
+        edges = tf.transpose(tf.cast(tf.nn.leaky_relu(edges, alpha=0.2), tf.float32))  # edge_size, heads
+
+        # softmax over each row's edges
+        edges = tf.exp(edges - tf.gather(tf.math.unsorted_segment_max(edges, rows, node_size), rows))
+        edges = edges / tf.gather(tf.math.unsorted_segment_sum(edges, rows, node_size), rows)
+        edges = tf.cast(edges, features.dtype)
+
+        dropout_attn = dropout(edges, self.dropout_prob, training)
+        dropout_feat = dropout(features, self.dropout_prob, training)
+
+        neighs = tf.gather(tf.transpose(dropout_feat, [1, 0, 2]), cols)  # edge_size, heads, units
+        node_features = tf.math.unsorted_segment_sum(tf.expand_dims(dropout_attn, -1) * neighs, rows, node_size)
+        return tf.transpose(node_features, [1, 0, 2])  # heads, node_size, units
 
     def compute_output_shape(self, input_shape):
         if self.attn_heads_reduction == "concat":
@@ -108,47 +126,62 @@ class GraphAttention(keras.layers.Layer):
 
 class GraphConvolution(keras.layers.Layer):
     """Basic graph convolution layer as in https://arxiv.org/abs/1609.02907"""
-    def __init__(self, units, activation='relu', use_bias=True, kernel_initializer='glorot_uniform',
-                 bias_initializer='zeros'):
-        super(GraphConvolution, self).__init__()
+    def __init__(self, units, activation='relu', use_bias=True, dropout_prob=0., kernel_initializer='glorot_uniform',
+                 bias_initializer='zeros', **kwargs):
+        super(GraphConvolution, self).__init__(**kwargs)
         self.units = units
         self.activation = keras.activations.get(activation)
         self.use_bias = use_bias
+        self.dropout_prob = dropout_prob
 
         self.kernel_initializer = kernel_initializer
         self.bias_initializer = bias_initializer
 
     def build(self, input_shapes):  # X, A
         features_shape = input_shapes[0]
-        adjoint_shape = input_shapes[1]  # support, node_size, node_size
+        adjoint_shape = input_shapes[1]  # support, node_size, node_size or node_size, node_size
         assert len(features_shape) == 2
         input_dim = features_shape[1]
-        support = adjoint_shape[0]
+        support = adjoint_shape[0] if len(adjoint_shape) == 3 else 1
         self.support = support
         self.kernel = self.add_weight(shape=(input_dim * support, self.units), initializer=self.kernel_initializer)
         if self.use_bias:
             self.bias = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
         self.built = True
 
-    def call(self, inputs, **kwargs):
+    def call(self, inputs, training=None, **kwargs):
         features = inputs[0]  # node_size, feautre_size
         basis = inputs[1]  # support, node_size, node_size
-
+        features = dropout(features, self.dropout_prob, training)  # dropped in place, before X·W
+
+        if isinstance(basis, tf.SparseTensor):
+            if basis.shape.rank == 2:
+                basis = tf.sparse.expand_dims(basis, 0)
+            kernel = tf.reshape(self.kernel, [self.support, -1, self.units])  # support, feature_size, units
+            hidden = tf.reshape(tf.einsum("nf,sfu->snu", features, kernel), [-1, self.units])  # support * node_size, units
+            # rows of basis may be a block of the nodes, the columns always cover all of them
+            basis = tf.sparse.reshape(tf.sparse.transpose(basis, [1, 0, 2]), [basis.dense_shape[1], -1])  # rows, support * node_size
+            output = tf.sparse.sparse_dense_matmul(basis, hidden)
+            if self.use_bias:
+                output = tf.nn.bias_add(output, self.bias)
+            return self.activation(output)
+
+        if basis.shape.rank == 2:
+            basis = tf.expand_dims(basis, 0)
         output = tf.matmul(basis, features)  # support, node_size, feature_size
-        os = list()
-        for i in range(self.support):
-            os.append(output[i])
-        output = tf.concat(os, axis=1)
-        output = tf.matmul(output, self.kernel)
+        kernel = tf.reshape(self.kernel, [self.support, -1, self.units])  # same order as concatenating the slices
+        output = tf.einsum("snf,sfu->nu", output, kernel)
         if self.use_bias:
             output = tf.nn.bias_add(output, self.bias)
         return self.activation(output)
 
 
 class GCNFilter(keras.layers.Layer):
-    def __init__(self, mode="localpool", support=1):
+    def __init__(self, mode="localpool", support=1, self_loop=False):
         super(GCNFilter, self).__init__()
         self.support = support
+        self.self_loop = self_loop
+        self._basis = None  # set by cache_basis for a static graph
         if mode == "localpool":
             self.process = self._localpool
             assert support >= 1
@@ -158,40 +191,75 @@ class GCNFilter(keras.layers.Layer):
 
     def build(self, input_shapes):
         self.shape = input_shapes[1]
+        if self.process == self._chebyshev:
+            self.eye = self.add_weight(shape=(self.shape, self.shape), trainable=False,
+                                       initializer=keras.initializers.Identity())
         self.built = True
 
+    def cache_basis(self, adj):  # build the basis of a static graph once, later calls return it; None clears it
+        if adj is not None and not self.built:
+            self.build(adj.shape)
+        self._basis = None if adj is None else self.process(adj)
+        return self._basis
+
     def call(self, inputs, **kwargs):
+        if self._basis is not None:
+            return self._basis
         return self.process(inputs)
 
+    def _normalize(self, inputs):  # D^-1/2 A D^-1/2, edge-parallel when A is sparse
+        inputs = tf.cast(inputs, tf.float32)
+        if isinstance(inputs, tf.SparseTensor):
+            if self.self_loop:
+                inputs = tf.sparse.add(inputs, tf.sparse.eye(inputs.dense_shape[0], inputs.dense_shape[1]))
+            d = tf.math.divide_no_nan(1., tf.sqrt(tf.sparse.reduce_sum(inputs, axis=-1)))
+            values = inputs.values * tf.gather(d, inputs.indices[:, 0]) * tf.gather(d, inputs.indices[:, 1])
+            return tf.SparseTensor(inputs.indices, values, inputs.dense_shape)
+        if self.self_loop:
+            inputs = inputs + tf.eye(tf.shape(inputs)[0])
+        d = tf.math.divide_no_nan(1., tf.sqrt(tf.reduce_sum(inputs, axis=-1)))
+        return tf.expand_dims(d, -1) * inputs * d  # same D A D as the sparse branch
+
     def _localpool(self, inputs):
-        d = tf.linalg.diag(tf.pow(tf.reduce_sum(inputs, axis=-1), -0.5))
-        out = tf.matmul(tf.transpose(tf.matmul(inputs, d)), d)
-        out = tf.stack([out])
-        return out
+        out = self._normalize(inputs)
+        if isinstance(out, tf.SparseTensor):
+            return tf.sparse.expand_dims(out, 0)
+        return tf.expand_dims(out, 0)
+
+    def _largest_eigval(self, adj_norm, iters=20):  # power iteration on L = I - adj_norm, only mat-vec products
+        matmul = tf.sparse.sparse_dense_matmul if isinstance(adj_norm, tf.SparseTensor) else tf.matmul
+        # fixed-seed start, so the same graph always gets the same estimate and basis; all ones could sit in
+        # the null space of L on a regular graph
+        v = tf.math.l2_normalize(tf.random.stateless_normal([self.shape, 1], seed=[0, 0]), axis=0)
+        for _ in range(iters):
+            v = tf.math.l2_normalize(v - matmul(adj_norm, v), axis=0)
+        return tf.reduce_sum(v * (v - matmul(adj_norm, v)))  # Rayleigh quotient
 
     def _chebyshev(self, inputs):
-        d = tf.linalg.diag(tf.pow(tf.reduce_sum(inputs, axis=-1), -0.5))
-        adj_norm = tf.matmul(tf.transpose(tf.matmul(inputs, d)), d)
-        laplacian = tf.eye(self.shape) - adj_norm
-        largest_eigval = tf.math.reduce_max(tf.linalg.eigvalsh(laplacian))
-        scaled_laplacian = (2. / largest_eigval) * laplacian - tf.eye(self.shape)
-        out = list()
-        out.append(tf.eye(self.shape))
-        out.append(scaled_laplacian)
-        for i in range(2, self.support+1):
-            o = 2 * tf.matmul(scaled_laplacian, out[-1]) - out[-2]
-            out.append(o)
-        out = tf.stack(out)
-        return out
+        adj_norm = self._normalize(inputs)
+        largest_eigval = self._largest_eigval(adj_norm)
+        if isinstance(adj_norm, tf.SparseTensor):
+            adj_norm = tf.sparse.to_dense(tf.sparse.reorder(adj_norm))
+        laplacian = self.eye - adj_norm
+        scaled_laplacian = (2. / largest_eigval) * laplacian - self.eye
+        out = tf.TensorArray(tf.float32, size=self.support+1, clear_after_read=False).write(0, self.eye).write(1, scaled_laplacian)
+
+        def body(i, out):  # T_i = 2 L T_{i-1} - T_{i-2}
+            o = 2. * tf.matmul(scaled_laplacian, out.read(i-1)) - out.read(i-2)
+            return i + 1, out.write(i, o)
+
+        _, out = tf.while_loop(lambda i, _: i <= self.support, body, [tf.constant(2), out])
+        return out.stack()
 
 
 class Bilinear(keras.layers.Layer):
-    def __init__(self, unit, activation='elu', use_bias=True, kernel_initializer='glorot_uniform',
+    def __init__(self, unit, activation='elu', use_bias=True, rank=None, kernel_initializer='glorot_uniform',
                  bias_initializer='zeros'):
         super(Bilinear, self).__init__()
-        self.unit = unit
+        self.units = unit
         self.activation = keras.activations.get(activation)
         self.use_bias = use_bias
+        self.rank = rank  # None keeps the full i1 x i2 x units kernel
 
         self.kernel_initializer = kernel_initializer
         self.bias_initializer = bias_initializer
@@ -200,15 +268,25 @@ class Bilinear(keras.layers.Layer):
         assert len(input_shape) == 2
         i1 = input_shape[0][-1]
         i2 = input_shape[1][-1]
-        self.kernel = self.add_weight(shape=(i1, i2, self.units), initializer=self.kernel_initializer)
+        if self.rank is None:
+            self.kernel = self.add_weight(shape=(i1, i2, self.units), initializer=self.kernel_initializer)
+        else:  # kernel[i, j, k] = sum_r kernel1[i, r, k] * kernel2[j, r, k]
+            self.kernel1 = self.add_weight(shape=(i1, self.rank, self.units), initializer=self.kernel_initializer)
+            self.kernel2 = self.add_weight(shape=(i2, self.rank, self.units), initializer=self.kernel_initializer)
         if self.use_bias:
             self.bias = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
         self.built = True
 
+    @tf.function(jit_compile=True)
     def call(self, inputs, **kwargs):
         i1 = inputs[0]  # batch, embed_size
         i2 = inputs[1]  # batch, embed_size
-        output = tf.einsum("b...i,b...j,ijk->b...k", i1, i2, self.kernel)
+        if self.rank is None:
+            output = tf.einsum("b...i,ijk->b...jk", i1, self.kernel)  # batch, i2_size, units
+            output = tf.einsum("b...jk,b...j->b...k", output, i2)
+        else:
+            output = tf.einsum("b...i,irk->b...rk", i1, self.kernel1) * tf.einsum("b...j,jrk->b...rk", i2, self.kernel2)
+            output = tf.reduce_sum(output, axis=-2)  # batch, units
         if self.use_bias:
             output = tf.nn.bias_add(output, self.bias)
         output = self.activation(output)
@@ -257,11 +335,12 @@ class GraphSageConv(keras.layers.Layer):
             self.pool_b = self.add_weight(shape=(neigh_unit, ), initializer=self.bias_initializer)
         self.built = True
 
-    def call(self, inputs, **kwargs):
+    def call(self, inputs, training=None, **kwargs):
         x, a = inputs
-        a = tf.sparse.from_dense(a)
+        if not isinstance(a, tf.SparseTensor):  # only the edge indices are used
+            a = tf.sparse.from_dense(a)
         o = self.agg(x, a)
-        o = tf.nn.dropout(o, self.dropout_prob)
+        o = dropout(o, self.dropout_prob, training)
         o = tf.math.l2_normalize(o, axis=-1)
         return o
 
@@ -271,7 +350,7 @@ class GraphSageConv(keras.layers.Layer):
         from_neighs = tf.matmul(from_neighs, self.neigh_weights)
 
         if not self.concat:
-            output = tf.add_n([from_self, from_neighs])
+            output = from_self + from_neighs
         else:
             output = tf.concat([from_self, from_neighs], axis=-1)
 
@@ -282,11 +361,14 @@ class GraphSageConv(keras.layers.Layer):
 
     def mean(self, x, a: tf.SparseTensor):
         from_self = tf.matmul(x, self.self_weights)
-        from_neighs = tf.math.unsorted_segment_mean(tf.gather(x, a.indices[:, 0], axis=-2), a.indices[:, 1], x.shape[0])
-        from_neighs = tf.matmul(from_neighs, self.neigh_weights)
+        # the mean over in-edges is one SpMM with a row-normalized transpose of a, taken after the projection
+        src, dst = a.indices[:, 0], a.indices[:, 1]
+        degree = tf.math.unsorted_segment_sum(tf.ones_like(dst, x.dtype), dst, x.shape[0])
+        a_mean = tf.SparseTensor(tf.stack([dst, src], axis=-1), tf.gather(1. / degree, dst), [x.shape[0], x.shape[0]])
+        from_neighs = tf.sparse.sparse_dense_matmul(a_mean, tf.matmul(x, self.neigh_weights))
 
         if not self.concat:
-            output = tf.add_n([from_self, from_neighs])
+            output = from_self + from_neighs
         else:
             output = tf.concat([from_self, from_neighs], axis=-1)
 
@@ -319,30 +401,30 @@ class GRUCell(keras.layers.AbstractRNNCell):
         self.bias_initializer = bias_initializer
     
     def build(self, input_shape):
-        self.Wz = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Uz = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bz = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wr = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Ur = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.br = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wh = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
+        # gate kernels are stored side by side (z, r, h) so each side of the cell is one matmul
+        self.W = self.add_weight(shape=(input_shape[-1], self.units * 3), initializer=self.kernel_initializer)
+        self.Uzr = self.add_weight(shape=(self.units, self.units * 2), initializer=self.recurrent_initializer)
         self.Uh = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bh = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
+        self.b = self.add_weight(shape=(self.units * 3,), initializer=self.bias_initializer)
+
+    @tf.function(jit_compile=True)
+    def call(self, input_at_t, states_at_t, training=None):  # batch, embed_size;batch, units *seq_len;
+        state_at_t = dropout(states_at_t[0], self.dropout_prob, training)  # batch, units
+        input_at_t = dropout(input_at_t, self.dropout_prob, training)
+        xz, xr, xh = tf.split(tf.matmul(input_at_t, self.W) + self.b, 3, axis=-1)
+        hz, hr = tf.split(tf.matmul(state_at_t, self.Uzr), 2, axis=-1)
 
-    def call(self, input_at_t, states_at_t):  # batch, embed_size;batch, units *seq_len;
-        state_at_t = keras.layers.Dropout(self.dropout_prob)(states_at_t[0])  # batch, units
-        input_at_t = keras.layers.Dropout(self.dropout_prob)(input_at_t)
-        zt = self.recurrent_activation(tf.matmul(input_at_t, self.Wz) + tf.matmul(state_at_t, self.Uz) + self.bz)
-        zt = keras.layers.Dropout(self.recurrent_dropout_prob)(zt)
+        zt = self.recurrent_activation(xz + hz)
+        zt = dropout(zt, self.recurrent_dropout_prob, training)
 
-        rt = self.recurrent_activation(tf.matmul(input_at_t, self.Wr) + tf.matmul(state_at_t, self.Ur) + self.br)
-        rt = keras.layers.Dropout(self.recurrent_dropout_prob)(rt)
+        rt = self.recurrent_activation(xr + hr)
+        rt = dropout(rt, self.recurrent_dropout_prob, training)
 
-        ht_ = self.recurrent_activation(tf.matmul(input_at_t, self.Wh) + tf.matmul(state_at_t * rt, self.Uh) + self.bh)
-        ht_ = keras.layers.Dropout(self.recurrent_dropout_prob)(ht_)
+        ht_ = self.recurrent_activation(xh + tf.matmul(state_at_t * rt, self.Uh))
+        ht_ = dropout(ht_, self.recurrent_dropout_prob, training)
 
-        ht = (1 - zt) * state_at_t + zt * ht_
-        ht = keras.layers.Dropout(self.dropout_prob)(ht)
+        ht = state_at_t + zt * (ht_ - state_at_t)  # lerp, same as (1 - zt) * state + zt * ht_
+        ht = dropout(ht, self.dropout_prob, training)
         return ht, ht
     
     @property
@@ -370,49 +452,34 @@ class LSTMCell(keras.layers.AbstractRNNCell):
         self.bias_initializer = bias_initializer
 
     def build(self, input_shape):  # batch, seq_len, embed_size
-        self.batch = input_shape[0]
         self.embed_size = input_shape[1]
 
-        self.Wf = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Uf = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bf = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wi = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Ui = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bi = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wo = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Uo = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bo = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wc = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Uc = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bc = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-
-    def call(self, input_at_t, states_at_t):  # batch, embed_size;batch, units *seq_len;
-        state_at_t = states_at_t[0]  # batch, units * 2
-        h_at_t = tf.slice(state_at_t, [0, 0], [self.batch, self.units])
-        c_at_t = tf.slice(state_at_t, [0, self.units], [self.batch, self.units])
-        h_at_t = keras.layers.Dropout(self.dropout_prob)(h_at_t)
-        c_at_t = keras.layers.Dropout(self.dropout_prob)(c_at_t)
-        input_at_t = keras.layers.Dropout(self.dropout_prob)(input_at_t)
-
-        ft = self.recurrent_activation(tf.matmul(input_at_t, self.Wf) + tf.matmul(h_at_t, self.Uf) + self.bf)
-        ft = keras.layers.Dropout(self.recurrent_dropout_prob)(ft)
-
-        it = self.recurrent_activation(tf.matmul(input_at_t, self.Wi) + tf.matmul(h_at_t, self.Ui) + self.bi)
-        it = keras.layers.Dropout(self.recurrent_dropout_prob)(it)
-
-        ot = self.recurrent_activation(tf.matmul(input_at_t, self.Wo) + tf.matmul(h_at_t, self.Uo) + self.bo)
-        ot = keras.layers.Dropout(self.recurrent_dropout_prob)(ot)
-
-        ct_ = self.recurrent_activation(tf.matmul(input_at_t, self.Wc) + tf.matmul(h_at_t, self.Uc) + self.bc)
-        ct_ = keras.layers.Dropout(self.recurrent_dropout_prob)(ct_)
+        # gate kernels are stored side by side (f, i, o, c) so each side of the cell is one matmul
+        self.W = self.add_weight(shape=(input_shape[-1], self.units * 4), initializer=self.kernel_initializer)
+        self.U = self.add_weight(shape=(self.units, self.units * 4), initializer=self.recurrent_initializer)
+        self.b = self.add_weight(shape=(self.units * 4,), initializer=self.bias_initializer)
+
+    @tf.function(jit_compile=True)
+    def call(self, input_at_t, states_at_t, training=None):  # batch, embed_size;batch, units *seq_len;
+        h_at_t, c_at_t = states_at_t  # batch, units;batch, units
+        h_at_t = dropout(h_at_t, self.dropout_prob, training)
+        c_at_t = dropout(c_at_t, self.dropout_prob, training)
+        input_at_t = dropout(input_at_t, self.dropout_prob, training)
+
+        gates = self.recurrent_activation(tf.matmul(input_at_t, self.W) + tf.matmul(h_at_t, self.U) + self.b)
+        ft, it, ot, ct_ = tf.split(gates, 4, axis=-1)
+        ft = dropout(ft, self.recurrent_dropout_prob, training)
+        it = dropout(it, self.recurrent_dropout_prob, training)
+        ot = dropout(ot, self.recurrent_dropout_prob, training)
+        ct_ = dropout(ct_, self.recurrent_dropout_prob, training)
 
         ct = ft * c_at_t + it * ct_
         ht = ot * self.activation(ct)
-        return ht, tf.concat([ht, ct], axis=-1)
+        return ht, [ht, ct]
 
     @property
     def state_size(self):
-        return self.units * 2
+        return [self.units, self.units]
 
     def compute_output_shape(self, input_shape):
         return input_shape[0], self.units
@@ -435,59 +502,44 @@ class TLSTMCell(keras.layers.AbstractRNNCell):
         self.bias_initializer = bias_initializer
         self.delta_dim = delta_dim
 
-    def build(self, input_shape):  # batch, seq_len, embed_size+delta_dim
-        self.batch = input_shape[0]
-        self.embed_size = input_shape[1] - 1
+    def build(self, input_shape):  # batch, embed_size+delta_dim
+        self.embed_size = input_shape[-1] - self.delta_dim
 
         self.Wd = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_activation)
         self.bd = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
 
-        self.Wf = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Uf = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bf = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wi = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Ui = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bi = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wo = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Uo = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bo = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wc = self.add_weight(shape=(input_shape[-1], self.units), initializer=self.kernel_initializer)
-        self.Uc = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bc = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-
-    def call(self, input_at_t, states_at_t):  # batch, embed_size+delta_dim;batch, units *seq_len;
-        state_at_t = states_at_t[0]  # batch, units * 2
-        h_at_t = tf.slice(state_at_t, [0, 0], [self.batch, self.units])
-        c_at_t = tf.slice(state_at_t, [0, self.units], [self.batch, self.units])
-        h_at_t = keras.layers.Dropout(self.dropout_prob)(h_at_t)
-        c_at_t = keras.layers.Dropout(self.dropout_prob)(c_at_t)
-        delta_t = tf.slice(input_at_t, [0, self.embed_size], [self.batch, self.delta_dim])
-        input_at_t = tf.slice([input_at_t], [0, 0], [self.batch, self.embed_size])
-        input_at_t = keras.layers.Dropout(self.dropout_prob)(input_at_t)
+        # gate kernels are stored side by side (f, i, o, c) so each side of the cell is one matmul
+        self.W = self.add_weight(shape=(self.embed_size, self.units * 4), initializer=self.kernel_initializer)
+        self.U = self.add_weight(shape=(self.units, self.units * 4), initializer=self.recurrent_initializer)
+        self.b = self.add_weight(shape=(self.units * 4,), initializer=self.bias_initializer)
+
+    @tf.function(jit_compile=True)
+    def call(self, input_at_t, states_at_t, training=None):  # batch, embed_size+delta_dim;batch, units *seq_len;
+        h_at_t, c_at_t = states_at_t  # batch, units;batch, units
+        h_at_t = dropout(h_at_t, self.dropout_prob, training)
+        c_at_t = dropout(c_at_t, self.dropout_prob, training)
+        delta_t = input_at_t[:, self.embed_size:]  # batch, delta_dim
+        input_at_t = input_at_t[:, :self.embed_size]
+        input_at_t = dropout(input_at_t, self.dropout_prob, training)
         cs = self.activation(tf.matmul(c_at_t, self.Wd) + self.bd)  # batch, units
-        cs_ = cs * (1 / tf.log(2.7183 + delta_t))
+        cs_ = cs * tf.math.reciprocal(1. + tf.math.log1p(delta_t / math.e))  # 1 / log(e + delta_t)
         ct = c_at_t - cs
         c_at_t = ct + cs_
 
-        ft = self.recurrent_activation(tf.matmul(input_at_t, self.Wf) + tf.matmul(h_at_t, self.Uf) + self.bf)
-        ft = keras.layers.Dropout(self.recurrent_dropout_prob)(ft)
-
-        it = self.recurrent_activation(tf.matmul(input_at_t, self.Wi) + tf.matmul(h_at_t, self.Ui) + self.bi)
-        it = keras.layers.Dropout(self.recurrent_dropout_prob)(it)
-
-        ot = self.recurrent_activation(tf.matmul(input_at_t, self.Wo) + tf.matmul(h_at_t, self.Uo) + self.bo)
-        ot = keras.layers.Dropout(self.recurrent_dropout_prob)(ot)
-
-        ct_ = self.recurrent_activation(tf.matmul(input_at_t, self.Wc) + tf.matmul(h_at_t, self.Uc) + self.bc)
-        ct_ = keras.layers.Dropout(self.recurrent_dropout_prob)(ct_)
+        gates = self.recurrent_activation(tf.matmul(input_at_t, self.W) + tf.matmul(h_at_t, self.U) + self.b)
+        ft, it, ot, ct_ = tf.split(gates, 4, axis=-1)
+        ft = dropout(ft, self.recurrent_dropout_prob, training)
+        it = dropout(it, self.recurrent_dropout_prob, training)
+        ot = dropout(ot, self.recurrent_dropout_prob, training)
+        ct_ = dropout(ct_, self.recurrent_dropout_prob, training)
 
         ct = ft * c_at_t + it * ct_
         ht = ot * self.activation(ct)
-        return ht, tf.concat([ht, ct], axis=-1)
+        return ht, [ht, ct]
 
     @property
     def state_size(self):
-        return self.units * 2
+        return [self.units, self.units]
 
     def compute_output_shape(self, input_shape):
         return input_shape[0], self.units
@@ -513,30 +565,33 @@ class GCRN1Cell(keras.layers.AbstractRNNCell):
 
     def build(self, input_shape):  # node_size, seq_len, embed_size+node_size
         self.func = self.func_cls(**self.func_kwargs)
-        self.Wz = self.add_weight(shape=(self.units, self.units), initializer=self.kernel_initializer)
-        self.Uz = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bz = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wr = self.add_weight(shape=(self.units, self.units), initializer=self.kernel_initializer)
-        self.Ur = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.br = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
-        self.Wh = self.add_weight(shape=(self.units, self.units), initializer=self.kernel_initializer)
+        # gate kernels are stored side by side (z, r, h) so each side of the cell is one matmul
+        self.W = self.add_weight(shape=(self.units, self.units * 3), initializer=self.kernel_initializer)
+        self.Uzr = self.add_weight(shape=(self.units, self.units * 2), initializer=self.recurrent_initializer)
         self.Uh = self.add_weight(shape=(self.units, self.units), initializer=self.recurrent_initializer)
-        self.bh = self.add_weight(shape=(self.units,), initializer=self.bias_initializer)
+        self.b = self.add_weight(shape=(self.units * 3,), initializer=self.bias_initializer)
 
-    def call(self, input_at_t, states_at_t):  # node_size, embed_size; node_size, node_size * n
+    def call(self, input_at_t, states_at_t, training=None):  # node_size, embed_size; node_size, node_size * n
         state_at_t = states_at_t[0]
-        input_at_t = self.func([state_at_t, input_at_t])
-        zt = self.recurrent_activation(tf.matmul(input_at_t, self.Wz) + tf.matmul(state_at_t, self.Uz) + self.bz)
-        zt = keras.layers.Dropout(self.recurrent_dropout_prob)(zt)
+        input_at_t = self.func([state_at_t, input_at_t])  # may take a sparse path, so it stays outside XLA
+        return self._gates(input_at_t, state_at_t, training)
+
+    @tf.function(jit_compile=True)
+    def _gates(self, input_at_t, state_at_t, training):
+        xz, xr, xh = tf.split(tf.matmul(input_at_t, self.W) + self.b, 3, axis=-1)
+        hz, hr = tf.split(tf.matmul(state_at_t, self.Uzr), 2, axis=-1)
 
-        rt = self.recurrent_activation(tf.matmul(input_at_t, self.Wr) + tf.matmul(state_at_t, self.Ur) + self.br)
-        rt = keras.layers.Dropout(self.recurrent_dropout_prob)(rt)
+        zt = self.recurrent_activation(xz + hz)
+        zt = dropout(zt, self.recurrent_dropout_prob, training)
 
-        ht_ = self.recurrent_activation(tf.matmul(input_at_t, self.Wh) + tf.matmul(state_at_t * rt, self.Uh) + self.bh)
-        ht_ = keras.layers.Dropout(self.recurrent_dropout_prob)(ht_)
+        rt = self.recurrent_activation(xr + hr)
+        rt = dropout(rt, self.recurrent_dropout_prob, training)
 
-        ht = (1 - zt) * state_at_t + zt * ht_
-        ht = keras.layers.Dropout(self.dropout_prob)(ht)
+        ht_ = self.recurrent_activation(xh + tf.matmul(state_at_t * rt, self.Uh))
+        ht_ = dropout(ht_, self.recurrent_dropout_prob, training)
+
+        ht = state_at_t + zt * (ht_ - state_at_t)
+        ht = dropout(ht, self.dropout_prob, training)
         return ht, ht
 
     @property
@@ -570,7 +625,7 @@ class GCRN2Cell(keras.layers.AbstractRNNCell):
         self.func_kwargs = func_kwargs
 
     def build(self, input_shape):  # node_size, embed_size;node_size, node_size;
-
+        # one graph layer per term, with GraphAttention each gate keeps its own attention
         self.Wz = self.func_cls(**self.func_kwargs)
         self.Uz = self.func_cls(**self.func_kwargs)
         self.Wr = self.func_cls(**self.func_kwargs)
@@ -578,19 +633,19 @@ class GCRN2Cell(keras.layers.AbstractRNNCell):
         self.Wh = self.func_cls(**self.func_kwargs)
         self.Uh = self.func_cls(**self.func_kwargs)
 
-    def call(self, input_at_t, states_at_t):
+    def call(self, input_at_t, states_at_t, training=None):  # not jitted, every gate runs a graph layer
         state_at_t = states_at_t[0]
         zt = self.recurrent_activation(self.Wz([state_at_t, input_at_t]) + self.Uz([state_at_t, input_at_t]))
-        zt = tf.nn.dropout(zt, self.recurrent_dropout_prob)  # node_size, units
+        zt = dropout(zt, self.recurrent_dropout_prob, training)  # node_size, units
 
         rt = self.recurrent_activation(self.Wr([state_at_t, input_at_t]) + self.Ur([state_at_t, input_at_t]))
-        rt = tf.nn.dropout(rt, self.recurrent_dropout_prob)  # node_size, units
+        rt = dropout(rt, self.recurrent_dropout_prob, training)  # node_size, units
 
         ht_ = self.recurrent_activation(self.Wh([state_at_t, input_at_t]) + self.Uh([state_at_t * rt, input_at_t]))
-        ht_ = tf.nn.dropout(ht_, self.recurrent_dropout_prob)  # node_size, units
+        ht_ = dropout(ht_, self.recurrent_dropout_prob, training)  # node_size, units
 
-        ht = (1 - zt) * state_at_t + zt * ht_
-        ht = tf.nn.dropout(ht, self.dropout_prob)
+        ht = state_at_t + zt * (ht_ - state_at_t)
+        ht = dropout(ht, self.dropout_prob, training)
         return ht, ht
 
     @property
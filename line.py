@@ -1,9 +1,8 @@
 import tensorflow as tf
 import tensorflow.keras as keras
-import tensorflow_addons as tfa
 import argparse
 from data import Cora
-from utils import embed_visual
+from utils import embed_visual, adamw_weight_decay
 
 
 class LINE(keras.Model):
@@ -88,7 +87,7 @@ if __name__ == "__main__":
     batch = cora.g.edge_array[:, 0]
     label = cora.g.edge_array[:, 1]
     model = LINE(cora.g.node_size, arg.embed_size, order=2)
-    model.compile(optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay))
+    model.compile(optimizer=keras.optimizers.AdamW(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)))
     model.fit((batch, label), batch_size=arg.batch_size, epochs=arg.epoch_size)
     embedding_matrix = model(cora.g.node_array)
     embed_visual(embedding_matrix, label_array=cora.g.get_nodes_label(), filename="./results/img/cora_line.png")
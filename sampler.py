@@ -1,7 +1,17 @@
 import numpy as np
+import scipy.sparse as sp
 import tensorflow as tf
 
 from graph import StaticGraph, TemporalGraph
+from utils import convert_coo_to_sparse
+
+
+def sample_neighbors(adj_csr, nodes: np.ndarray) -> np.ndarray:  # one uniform neighbor per node, vectorized over the csr arrays
+    start = adj_csr.indptr[nodes]
+    degree = adj_csr.indptr[nodes + 1] - start
+    offset = (np.random.random(len(nodes)) * degree).astype(np.int64)
+    neighbors = adj_csr.indices[np.minimum(start + offset, len(adj_csr.indices) - 1)]
+    return np.where(degree > 0, neighbors, nodes).astype(np.int32)
 
 
 class NodeSampler:
@@ -12,38 +22,67 @@ class NodeSampler:
 
 
 class RandomSubGraph:
-    def __init__(self, g: StaticGraph, num_sample: int, num_sample_step: int):
+    def __init__(self, g: StaticGraph, num_sample: int, num_sample_step: int, num_pack: int = 1,
+                 feature: np.ndarray = None):
         self.g = g
         self.num_sample = num_sample
         self.num_sample_step = num_sample_step
+        self.num_pack = num_pack  # subgraphs packed block-diagonally into one batch
+        self.batch_size = num_sample * num_pack
+        # cast once here rather than per batch; a caller may pass e.g. a quantized int8 copy instead
+        self.feature = g.node_feature.astype(np.int32) if feature is None else feature
+        self.feature_spec = tf.TensorSpec(shape=(self.batch_size, self.feature.shape[1]), dtype=tf.as_dtype(self.feature.dtype))
+
+    def _sample_nodes(self):  # num_pack, num_sample
+        return np.random.randint(low=0, high=self.g.node_size, size=(self.num_pack, self.num_sample), dtype=np.int32)
+
+    def _adj_spec(self, dtype, sparse):
+        if sparse:
+            return tf.SparseTensorSpec(shape=(self.batch_size, self.batch_size), dtype=dtype)
+        return tf.TensorSpec(shape=(self.batch_size, self.batch_size), dtype=dtype)
+
+    @staticmethod
+    def _slice(adj_csr, sampler, dtype, sparse):
+        adj = sp.block_diag([adj_csr[s][:, s] for s in sampler], format="csr")
+        if sparse:
+            return convert_coo_to_sparse(adj, dtype)
+        return adj.toarray().astype(dtype)
+
+    def supervised_feature(self, norm=False, sparse=False):
+        adj_csr = self.g.adj_norm_csr if norm else self.g.adj_csr
+        adj_dtype = np.float32 if norm else np.int32
+        feature = self.feature
+        node_label = self.g.node_label.astype(np.int32)
 
-    def supervised_feature(self):
         def sample():
             for _ in range(self.num_sample_step):
-                sampler = np.random.randint(low=0, high=self.g.node_size, size=self.num_sample)
-                adjs = self.g.adj_csr[sampler][:, sampler].toarray().astype(np.int32)
-                xs = self.g.node_feature[sampler].astype(np.int32)
-                ys = self.g.node_label[sampler].astype(np.int32)
-                yield (xs, adjs), ys
-
-        sig = ((tf.TensorSpec(shape=(self.num_sample, self.g.node_feature_size), dtype=tf.int32),
-                tf.TensorSpec(shape=(self.num_sample, self.num_sample), dtype=tf.int32)),
-               tf.TensorSpec(shape=(self.num_sample, ), dtype=tf.int32))
+                sampler = self._sample_nodes()
+                adjs = self._slice(adj_csr, sampler, adj_dtype, sparse)
+                sampler = sampler.reshape(-1)
+                yield (feature[sampler], adjs), node_label[sampler]
+
+        sig = ((self.feature_spec,
+                self._adj_spec(tf.as_dtype(adj_dtype), sparse)),
+               tf.TensorSpec(shape=(self.batch_size, ), dtype=tf.int32))
         data = tf.data.Dataset.from_generator(sample, output_signature=sig)
+        data = data.prefetch(tf.data.experimental.AUTOTUNE)  # sample the next subgraph while the current step runs
         return data
 
-    def unsupervised_feature(self):
+    def unsupervised_feature(self, sparse=False):
+        adj_csr = self.g.adj_csr
+        feature = self.feature
+
         def sample():
             for _ in range(self.num_sample_step):
-                sampler = np.random.randint(low=0, high=self.g.node_size, size=self.num_sample, dtype=np.int32)
-                adjs = self.g.adj_csr[sampler][:, sampler].toarray().astype(np.int32)
-                xs = self.g.node_feature[sampler].astype(np.int32)
-                labels = np.asarray([np.random.choice(self.g.get_node_neighbors(node)) for node in sampler], dtype=np.int32)
-                yield (xs, adjs, labels),
-        sig = ((tf.TensorSpec(shape=(self.num_sample, self.g.node_feature_size), dtype=tf.int32),
-                tf.TensorSpec(shape=(self.num_sample, self.num_sample), dtype=tf.int32),
-                tf.TensorSpec(shape=(self.num_sample, ), dtype=tf.int32)),)
+                sampler = self._sample_nodes()
+                adjs = self._slice(adj_csr, sampler, np.int32, sparse)
+                sampler = sampler.reshape(-1)
+                yield (feature[sampler], adjs, sample_neighbors(adj_csr, sampler)),
+        sig = ((self.feature_spec,
+                self._adj_spec(tf.int32, sparse),
+                tf.TensorSpec(shape=(self.batch_size, ), dtype=tf.int32)),)
         data = tf.data.Dataset.from_generator(sample, output_signature=sig)
+        data = data.prefetch(tf.data.experimental.AUTOTUNE)  # sample the next subgraph while the current step runs
         return data
 
 
@@ -54,39 +93,47 @@ class RandomTemporalSubGraph:
         self.num_sample_step = num_sample_step
 
     def supervised(self):
+        node_size = self.g.node_size
+        adj_csr_list = self.g.discrete_adj_csr_list
+        node_label = self.g.node_label.astype(np.int32)
+
         def sample():
             for _ in range(self.num_sample_step):
-                sampler = np.random.randint(low=0, high=self.g.node_size, size=self.num_sample)
+                sampler = np.random.randint(low=0, high=node_size, size=self.num_sample)
                 adjs = []
-                for adj_csr in self.g.discrete_adj_csr_list:
+                for adj_csr in adj_csr_list:
                     adj = adj_csr[sampler][:, sampler].toarray().astype(np.int32)
                     adjs.append(adj)
                 adjs = np.stack(adjs, axis=1)
-                ys = self.g.node_label[sampler].astype(np.int32)
-                yield (sampler, adjs), ys
+                yield (sampler, adjs), node_label[sampler]
 
         sig = ((tf.TensorSpec(shape=(self.num_sample, ), dtype=tf.int32),
                 tf.TensorSpec(shape=(self.num_sample, len(self.g.discrete_adj_list), self.num_sample), dtype=tf.int32)),
                tf.TensorSpec(shape=(self.num_sample, ), dtype=tf.int32))
         data = tf.data.Dataset.from_generator(sample, output_signature=sig)
+        data = data.prefetch(tf.data.experimental.AUTOTUNE)  # sample the next subgraph while the current step runs
         return data
 
     def unsupervised(self):
+        node_size = self.g.node_size
+        adj_csr_list = self.g.discrete_adj_csr_list[:-1]
+        label_adj_csr = self.g.discrete_adj_csr_list[-1]
+
         def sample():
             for _ in range(self.num_sample_step):
-                sampler = np.random.randint(low=0, high=self.g.node_size, size=self.num_sample)
+                sampler = np.random.randint(low=0, high=node_size, size=self.num_sample)
                 adjs = []
-                for adj_csr in self.g.discrete_adj_csr_list[:-1]:
+                for adj_csr in adj_csr_list:
                     adj = adj_csr[sampler][:, sampler].toarray().astype(np.int32)
                     adjs.append(adj)
                 adjs = np.stack(adjs, axis=1)
-                labels = np.asarray([np.random.choice(self.g.discrete_g_list[-1].get_node_neighbors(node)) for node in sampler], dtype=np.int32)
-                yield (sampler, adjs, labels),
+                yield (sampler, adjs, sample_neighbors(label_adj_csr, sampler)),
 
         sig = ((tf.TensorSpec(shape=(self.num_sample, ), dtype=tf.int32),
                 tf.TensorSpec(shape=(self.num_sample, len(self.g.discrete_adj_list) - 1, self.num_sample), dtype=tf.int32),
                 tf.TensorSpec(shape=(self.num_sample, ), dtype=tf.int32)),)
         data = tf.data.Dataset.from_generator(sample, output_signature=sig)
+        data = data.prefetch(tf.data.experimental.AUTOTUNE)  # sample the next subgraph while the current step runs
         return data
 
 
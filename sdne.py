@@ -1,10 +1,9 @@
 import tensorflow.keras as keras
 import tensorflow as tf
-import tensorflow_addons as tfa
 import numpy as np
 import argparse
 from data import Cora
-from utils import embed_visual
+from utils import embed_visual, adamw_weight_decay
 
 
 class SDNE(keras.Model):
@@ -23,18 +22,19 @@ class SDNE(keras.Model):
         self.decoder = keras.Sequential([
             keras.layers.Dense(self.embed_size, activation="relu"),
             keras.layers.Dense(self.embed_size, activation="relu"),
-            keras.layers.Dense(self.node_size, activation="relu"),
+            keras.layers.Dense(self.node_size, dtype="float32"),  # linear reconstruction, loss in float32
         ])
 
-    def _loss_1(self, A, enc_out):
-        D = tf.linalg.diag(tf.reduce_sum(A, 1))
-        L = D - A
-        return 2 * tf.linalg.trace(tf.matmul(tf.matmul(tf.transpose(enc_out), L), enc_out))
+    def _loss_1(self, A, enc_out):  # 2 tr(Z^T (D - A) Z) without forming D or L
+        d = tf.reduce_sum(A, 1)
+        return 2 * (tf.reduce_sum(d * tf.reduce_sum(tf.square(enc_out), 1)) - tf.reduce_sum(enc_out * tf.matmul(A, enc_out)))
 
-    def _loss_2(self, inp, oup, B):
-        return tf.reduce_sum(tf.square((inp - oup) * B))
+    def _loss_2(self, inp, oup, B):  # B holds the squared weights, beta^2 on edges
+        return tf.reduce_sum(tf.math.squared_difference(inp, oup) * B)
 
     def _loss_final(self, A, inp, enc_out, dec_out, B):
+        # under mixed_bfloat16 the model autocasts its inputs, the decoder head is float32, so take the loss in float32
+        A, inp, enc_out, B = [tf.cast(t, tf.float32) for t in (A, inp, enc_out, B)]
         return self._loss_2(inp, dec_out, B) + self.alpha * self._loss_1(A, enc_out)
 
     def call(self, inputs, training=None, mask=None):
@@ -43,7 +43,8 @@ class SDNE(keras.Model):
             enc_output = self.encoder(adj_batch_train)
             dec_output = self.decoder(enc_output)
             loss = self._loss_final(adj_mat_train, adj_batch_train, enc_output, dec_output, b_mat_train)
-            self.add_loss(loss)
+            # fit divides add_loss terms by the replica count, undo it so the replicas sum to the full-batch loss
+            self.add_loss(loss * tf.distribute.get_strategy().num_replicas_in_sync)
             return enc_output
         else:
             enc_output = self.encoder(inputs)
@@ -59,7 +60,14 @@ if __name__ == "__main__":
     parser.add_argument("--batch_size", type=int, default=512)
     parser.add_argument("--alpha", type=float, default=0.3)
     parser.add_argument("-beta", type=float, default=10.)
+    parser.add_argument("--mixed_precision", action="store_true")
+    parser.add_argument("--mirrored", action="store_true",
+                        help="data-parallel over local GPUs; the first-order loss only pairs nodes within each "
+                             "replica's share of the batch (a block-diagonal approximation)")
+    parser.add_argument("--optimizer", type=str, default="adamw", choices=["adamw", "nadam"])
     arg = parser.parse_args()
+    if arg.mixed_precision:
+        keras.mixed_precision.set_global_policy("mixed_bfloat16")
 
     gpus = tf.config.experimental.list_physical_devices('GPU')
     if gpus:
@@ -69,23 +77,36 @@ if __name__ == "__main__":
         except RuntimeError as e:
             print(e)
 
+    strategy = tf.distribute.MirroredStrategy() if arg.mirrored else tf.distribute.get_strategy()
+    assert arg.batch_size % strategy.num_replicas_in_sync == 0
+    replica_size = arg.batch_size // strategy.num_replicas_in_sync  # fit splits each batch row-wise over the replicas
+
     cora = Cora()
 
+    adj_csr = cora.g.adj_csr
+    rng = np.random.default_rng()
+
     def gen():
+        nodes = rng.permutation(cora.g.node_size)  # fit restarts the generator, so every epoch gets new batches
         for batch_num in range(cora.g.node_size // arg.batch_size):
-            start_index = batch_num * arg.batch_size
-            end_index = (batch_num + 1) * arg.batch_size
-            adj_batch_train = cora.g.adj_csr[start_index:end_index, :].toarray().astype(np.float32)
-            adj_mat_train = adj_batch_train[:, start_index:end_index]
-            b_mat_train = np.ones_like(adj_batch_train).astype(np.float32)
-            b_mat_train[adj_batch_train != 0] = arg.beta
+            index = nodes[batch_num * arg.batch_size:(batch_num + 1) * arg.batch_size]
+            adj_batch_train = adj_csr[index].toarray().astype(np.float32)
+            # each replica only sees its own rows, so the laplacian term is taken within each replica's block
+            adj_mat_train = np.concatenate([adj_batch_train[start:start + replica_size, index[start:start + replica_size]]
+                                            for start in range(0, arg.batch_size, replica_size)])
+            b_mat_train = 1. + np.float32(arg.beta ** 2 - 1.) * (adj_batch_train != 0)  # beta^2 on edges, 1 elsewhere
             yield (adj_batch_train, adj_mat_train, b_mat_train),
-    data = tf.data.Dataset.from_generator(gen, output_signature=((tf.TensorSpec(shape=[arg.batch_size, cora.g.node_size], dtype=tf.float32), tf.TensorSpec(shape=[arg.batch_size, arg.batch_size], dtype=tf.float32), tf.TensorSpec(shape=[arg.batch_size, cora.g.node_size], dtype=tf.float32)),))
+    data = tf.data.Dataset.from_generator(gen, output_signature=((tf.TensorSpec(shape=[arg.batch_size, cora.g.node_size], dtype=tf.float32), tf.TensorSpec(shape=[arg.batch_size, replica_size], dtype=tf.float32), tf.TensorSpec(shape=[arg.batch_size, cora.g.node_size], dtype=tf.float32)),))
     data = data.prefetch(tf.data.experimental.AUTOTUNE)
 
-    model = SDNE(cora.g.node_size, arg.embed_size, alpha=arg.alpha)
-    model.compile(optimizer=tfa.optimizers.AdamW(learning_rate=arg.lr, weight_decay=arg.weight_decay))
+    with strategy.scope():
+        model = SDNE(cora.g.node_size, arg.embed_size, alpha=arg.alpha)
+        optimizer_cls = keras.optimizers.Nadam if arg.optimizer == "nadam" else keras.optimizers.AdamW
+        model.compile(optimizer=optimizer_cls(learning_rate=arg.lr, weight_decay=adamw_weight_decay(arg.weight_decay, arg.lr)),
+                      jit_compile=True)  # batches have a fixed shape, so the train step compiles once
     model.fit(data, epochs=arg.epoch_size)
 
-    embedding_matrix = model(cora.g.adj.toarray())
+    # encode the rows of the csr adjacency a batch at a time instead of densifying all N x N
+    embedding_matrix = np.concatenate([model(cora.g.adj_csr[start:start + arg.batch_size].toarray().astype(np.float32)).numpy()
+                                       for start in range(0, cora.g.node_size, arg.batch_size)])
     embed_visual(embedding_matrix, cora.g.get_nodes_label(), filename="./results/img/cora_sdne.png")
@@ -95,11 +95,25 @@ def generate_word(sentences, num_skips=2, skip_window=2):  # generate train data
     return batch, label
 
 
-def convert_coo_to_sparse(A):
-    indices = np.stack([A.row, A.col], axis=-1)
+def convert_coo_to_sparse(A, dtype=tf.float32):
+    A = A.tocoo()
+    indices = np.stack([A.row, A.col], axis=-1).astype(np.int64)
     values = A.data
     dense_shape = A.shape
-    return tf.SparseTensor(indices, values, dense_shape)
+    return tf.sparse.reorder(tf.SparseTensor(indices, tf.cast(values, dtype), dense_shape))
+
+
+def quantize_feature(x):  # per column int8 quantization of a non-negative feature matrix
+    scale = x.max(axis=0).astype(np.float32) / 127
+    scale[scale == 0] = 1.
+    x_q = np.round(x / scale).astype(np.int8)
+    return x_q, scale
+
+
+def adamw_weight_decay(weight_decay, lr):  # keras' AdamW scales the decay by the learning rate, tfa's did not
+    if lr == 0:  # no step is taken, so there is nothing to decay
+        return 0.
+    return weight_decay / lr
 
 
 class Vocab: